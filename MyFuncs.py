@@ -1,38 +1,100 @@
-import pandas as pd
-import numpy as np
-import plotly.graph_objs as go
 import pickle
+import hashlib
+import os
+import json
+import shutil
+import sqlite3
+import itertools
+import threading
+from collections import deque
+from functools import lru_cache
 
-def sample_data(df, n_samples=None, output=False):
+import metrics
+
+def sample_data(df, n_samples=None, output=False, method='strided', seed=None, stratify=None):
+	"""
+	Pick n_samples rows of df in a single vectorized pass.
+
+	method='strided' keeps every len(df) / n_samples-th row and returns a view,
+	method='random' draws rows without replacement using seed, and
+	method='stratified' draws from each value of the stratify column in
+	proportion to its size. Strided and random modes return exactly
+	n_samples rows (all of df if it is smaller). Stratified mode splits
+	n_samples between strata by largest remainder and keeps at least one row
+	of every non-empty stratum, so it can return a few more rows when there
+	are many small strata. Row order is preserved in every mode.
+	"""
+	import numpy as np
+	import pandas as pd
+
+	n_rows = len(df.index)
 	if n_samples is None:
-		n_samples = len(df.index) / 10
+		n_samples = n_rows / 10
+	n_samples = min(int(n_samples), n_rows)
 
-	interval = int(len(df.index) / n_samples)
+	if method == 'strided':
+		interval = max(n_rows // max(n_samples, 1), 1)
+		sample = df.iloc[0:n_samples * interval:interval]
+	elif method == 'random':
+		rng = np.random.default_rng(seed)
+		positions = rng.choice(n_rows, size=n_samples, replace=False)
+		sample = df.iloc[np.sort(positions)]
+	elif method == 'stratified':
+		if stratify is None:
+			raise ValueError("method='stratified' requires a stratify column")
+		rng = np.random.default_rng(seed)
+		# rank rows randomly inside each stratum and keep the first quota of each
+		keys = pd.Series(rng.random(n_rows))
+		groups = keys.groupby(df[stratify].to_numpy(), dropna=False)
+		stratum = groups.ngroup().to_numpy()
+		rank = groups.rank(method='first').to_numpy()
 
-	sample = pd.DataFrame(columns=df.columns)
+		sizes = np.bincount(stratum)
+		shares = sizes * (n_samples / max(n_rows, 1))
+		quota = np.floor(shares).astype(np.int64)
+		# hand the rows lost to rounding down to the largest remainders
+		quota[np.argsort(quota - shares, kind='stable')[:n_samples - quota.sum()]] += 1
+		if n_samples > 0:
+			quota = np.minimum(np.maximum(quota, 1), sizes)
+		sample = df.iloc[np.flatnonzero(rank <= quota[stratum])]
+	else:
+		raise ValueError(f"Unknown sampling method: {method}")
 
-	for i, _ in enumerate(df.index):
-		if i % interval == 0 and i / interval <= n_samples:
-			print(f"{i / interval} / {n_samples}")
-			sample = sample.append(df.iloc[i])
+	if output is True:
+		print(f"Sampled {len(sample.index)} / {n_rows} rows ({method})")
 
 	return sample
 
-def reduce_mem_usage(df, output=False, n_samples=None):
+def reduce_mem_usage(df, output=False, n_samples=None, sample_method='strided', seed=None, stratify=None, safe=False, max_category_ratio=0.5, report=False):
 	""" iterate through all the columns of a dataframe and modify the data type
         to reduce memory usage.        
+
+	With safe=True a float column is only downcast (to float32, never float16)
+	when every value survives the round trip, and an object column only
+	becomes a category when its distinct-value ratio is at most
+	max_category_ratio. With report=True a per-column report of the dtype
+	change and bytes saved is returned alongside the frame.
 	"""
+	import numpy as np
+	import pandas as pd
+
 	if n_samples is not None:
-		df = sample_data(df, n_samples, output)
+		df = sample_data(df, n_samples, output, method=sample_method, seed=seed, stratify=stratify).copy()
 
 	if output is True:
 		start_mem = df.memory_usage().sum() / 1024**2
 		print(f'Memory usage of dataframe is {start_mem:.2f} MB / {start_mem/1024:.2f} GB')
 
+	start_types = df.dtypes
+	start_bytes = df.memory_usage(index=False, deep=True)
+
 	for col in df:
 		col_type = df[col].dtype
 
-		if col_type != object:
+		if isinstance(col_type, pd.api.extensions.ExtensionDtype):
+			# categories and nullable integers were already chosen by the reader
+			continue
+		elif col_type != object:
 			c_min = df[col].min()
 			c_max = df[col].max()
 			if str(col_type)[:3] == 'int':
@@ -44,6 +106,10 @@ def reduce_mem_usage(df, output=False, n_samples=None):
 					df[col] = df[col].astype(np.int32)
 				elif c_min > np.iinfo(np.int64).min and c_max < np.iinfo(np.int64).max:
 					df[col] = df[col].astype(np.int64)  
+			elif safe is True:
+				values = df[col].to_numpy(dtype=np.float64)
+				if np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+					df[col] = df[col].astype(np.float32)
 			else:
 				if c_min > np.finfo(np.float16).min and c_max < np.finfo(np.float16).max:
 					df[col] = df[col].astype(np.float16)
@@ -51,6 +117,9 @@ def reduce_mem_usage(df, output=False, n_samples=None):
 					df[col] = df[col].astype(np.float32)
 				else:
 					df[col] = df[col].astype(np.float64)
+		elif safe is True:
+			if len(df.index) > 0 and df[col].nunique(dropna=False) / len(df.index) <= max_category_ratio:
+				df[col] = df[col].astype('category')
 		else:
 			df[col] = df[col].astype('category')
 
@@ -59,16 +128,94 @@ def reduce_mem_usage(df, output=False, n_samples=None):
 		print('Memory usage after optimization is: {:.2f} MB'.format(end_mem))
 		print('Decreased by {:.1f}%\n'.format(100 * (start_mem - end_mem) / start_mem))
 
+	if report is True:
+		end_bytes = df.memory_usage(index=False, deep=True)
+		changes = pd.DataFrame({'from': start_types.astype(str), 
+		                        'to': df.dtypes.astype(str), 
+		                        'bytes_before': start_bytes, 
+		                        'bytes_after': end_bytes, 
+		                        'bytes_saved': start_bytes - end_bytes})
+		return df, changes
+
+	return df
+
+def downcast_chunk(df):
+	"""
+	Lossless per-chunk downcast used while streaming: integers shrink to the
+	smallest type that holds the chunk and objects become categories. Floats
+	are left alone so the final pass over the whole frame picks their type.
+	"""
+	import pandas as pd
+
+	for col in df:
+		col_type = df[col].dtype
+
+		if str(col_type)[:3] == 'int':
+			df[col] = pd.to_numeric(df[col], downcast='integer')
+		elif col_type == object:
+			df[col] = df[col].astype('category')
+
+	return df
+
+def concat_chunks(chunks):
+	"""
+	Concatenate downcast chunks, merging the categories of categorical columns
+	instead of letting pandas fall back to object.
+	"""
+	import pandas as pd
+
+	df = pd.concat(chunks)
+
+	for col in chunks[0]:
+		if all(isinstance(chunk[col].dtype, pd.CategoricalDtype) for chunk in chunks):
+			df[col] = pd.api.types.union_categoricals([chunk[col] for chunk in chunks], sort_categories=True, ignore_order=True)
+
 	return df
 
-def import_data(file, dtypes=None, delimiter = None, encoding=None, output=False, index_col=None, n_samples=None, columns_to_keep=None, **kwargs):
+def import_data(file, dtypes=None, delimiter = None, encoding=None, output=False, index_col=None, n_samples=None, columns_to_keep=None, chunksize=None, **kwargs):
 	"""
 	Create a dataframe and optimize its memory usage
+
+	Only columns_to_keep are parsed. With chunksize set, the file is streamed
+	chunksize rows at a time and each chunk is downcast as it arrives, so peak
+	memory follows the chunk size rather than the file size. The result is the
+	same as a single read.
 	"""
+	import pandas as pd
+
 	if output is True:
 		print("\nLoading DataFrame...\n")
-	
-	df = pd.read_csv(file, dtype=dtypes, parse_dates=True, keep_date_col=True, delimiter=delimiter, encoding=encoding,index_col=index_col)
+
+	usecols = None
+	if columns_to_keep is not None:
+		usecols = list(columns_to_keep)
+		if isinstance(index_col, str) and index_col not in usecols:
+			usecols.append(index_col)
+
+	# the C reader parses nullable dtypes an order of magnitude slower than
+	# numpy ones, so those columns are read plainly and cast afterwards
+	cast = {}
+	if isinstance(dtypes, dict):
+		cast = {col: dtype for col, dtype in dtypes.items() 
+		        if isinstance(pd.api.types.pandas_dtype(dtype), pd.api.extensions.ExtensionDtype)}
+		dtypes = {col: dtype for col, dtype in dtypes.items() if col not in cast}
+
+	def cast_chunk(chunk):
+		return chunk.astype({col: dtype for col, dtype in cast.items() if col in chunk.columns})
+
+	with metrics.phase('csv_parse'):
+		reader = pd.read_csv(file, dtype=dtypes, parse_dates=True, keep_date_col=True, delimiter=delimiter, encoding=encoding, index_col=index_col, usecols=usecols, chunksize=chunksize)
+
+		if chunksize is not None:
+			df = concat_chunks([downcast_chunk(cast_chunk(chunk)) for chunk in reader])
+			if kwargs.get('safe') is True:
+				# categories only hold the strings while streaming: back as object
+				# (pointers to the same strings) reduce_mem_usage decides on the
+				# whole frame, exactly as it does after a single read
+				strings = [col for col in df if isinstance(df[col].dtype, pd.CategoricalDtype) and col not in cast]
+				df = df.astype({col: object for col in strings})
+		else:
+			df = cast_chunk(reader)
 
 	if columns_to_keep is not None:
 		df = df[columns_to_keep]
@@ -76,23 +223,454 @@ def import_data(file, dtypes=None, delimiter = None, encoding=None, output=False
 	if output is True:
 		print("\nDataFrame Loaded\n")
 
-	return reduce_mem_usage(df, output=output, n_samples=n_samples, **kwargs)
+	with metrics.phase('downcast'):
+		return reduce_mem_usage(df, output=output, n_samples=n_samples, **kwargs)
 
 cols_to_keep = ['YEAR', 'V3020', 'V3013', 'V2078', 'V2122', 'V2015', 'V2130', 'V2127B', 'V3015', 
                  'V2129', 'V2024', 'V2126B', 'V3029', 'V3017', 'V3033', 'V2026']
 
-def ncvs_small(n_samples=None, output=False, wrangle=False):
+# model inputs, in the order the pipeline was trained on
+feature_cols = [col for col in cols_to_keep if col != 'V2026']
+
+_schema = None
+
+def compile_schema():
+	"""
+	Map each dataDictionary variable to a fixed nullable integer dtype.
+
+	The upper bound of a variable comes from its labelled codes or, failing
+	that, from its all-nines "Out of universe" sentinel, which spans the full
+	field width (9, 99, 999, ...). Variables with neither (ids, years, weights)
+	are left out and keep their inferred dtype. import_data casts to these
+	types after parsing, so a value outside its bound raises instead of
+	wrapping around.
+	"""
+	import numpy as np
+
+	global _schema
+	if _schema is None:
+		_schema = {}
+		for col, entry in dataDictionary.items():
+			codes = [k for k in entry if isinstance(k, int)]
+			nines = [k for k in entry['Null'] if k > 0 and set(str(k)) == {'9'}]
+			bounds = codes + nines
+			if len(bounds) == 0:
+				continue
+
+			c_min = min(bounds + entry['Null'] + [0])
+			c_max = max(bounds + entry['Null'])
+			if c_min >= np.iinfo(np.int8).min and c_max <= np.iinfo(np.int8).max:
+				_schema[col] = 'Int8'
+			elif c_min >= np.iinfo(np.int16).min and c_max <= np.iinfo(np.int16).max:
+				_schema[col] = 'Int16'
+			else:
+				_schema[col] = 'Int32'
+
+	return dict(_schema)
+
+def wrangle_nulls(df):
+	"""
+	Replace every dataDictionary "Null" sentinel with NA, one vectorized mask
+	per column. Works the same on a whole frame or on a single streamed chunk.
+	"""
+	for col in df.columns:
+		if col in dataDictionary and len(dataDictionary[col]['Null']) > 0:
+			df[col] = df[col].mask(df[col].isin(dataDictionary[col]['Null']))
+
+	return df
+
+def binned_counts(x, y, weights=None):
+	"""
+	Count every (y, x) pair of two integer-coded columns with one np.bincount
+	over a combined index, summing weights instead of counting rows when they
+	are given. Rows with a missing value in any input are dropped. Returns the
+	count matrix as a crosstab-style DataFrame (y values down, x values across,
+	only observed values kept) and its [min, max]; with no rows left that is
+	an empty frame and [0, 0].
+	"""
+	import numpy as np
+	import pandas as pd
+
+	x = pd.Series(x)
+	y = pd.Series(y)
+	keep = (x.notna() & y.notna()).to_numpy()
+	if weights is not None:
+		weights = pd.Series(weights)
+		keep &= weights.notna().to_numpy()
+		weights = weights[keep].to_numpy(dtype=np.float64)
+	# filter before converting: nullable columns holding NA only convert via object
+	x = x[keep].to_numpy(dtype=np.int64)
+	y = y[keep].to_numpy(dtype=np.int64)
 
-    df = import_data('assets/files/ncvs_small.csv', n_samples=n_samples, output=output)
+	if len(x) == 0:
+		return pd.DataFrame(np.zeros((0, 0), dtype=np.int64 if weights is None else np.float64)), [0, 0]
 
-    if wrangle is True:
-        for col in df.columns:
-            for k in dataDictionary[col]['Null']:
-                df[col] = df[col].where(df[col] != k, None)
+	x_min, y_min = x.min(), y.min()
+	nx = x.max() - x_min + 1
+	ny = y.max() - y_min + 1
+	counts = np.bincount((y - y_min) * nx + (x - x_min), weights=weights, minlength=nx * ny).reshape(ny, nx)
 
-    df = df[cols_to_keep]
-    
-    return df
+	# keep values that occur at all, even if their weights sum to zero
+	occurs = np.bincount((y - y_min) * nx + (x - x_min), minlength=nx * ny).reshape(ny, nx) if weights is not None else counts
+	cols = occurs.any(axis=0)
+	rows = occurs.any(axis=1)
+	counts = pd.DataFrame(counts[rows][:, cols], 
+	                      index=np.arange(y_min, y_min + ny)[rows], 
+	                      columns=np.arange(x_min, x_min + nx)[cols])
+
+	return counts, [counts.values.min(), counts.values.max()]
+
+def survey_aggregates(df, by='V2026'):
+	"""
+	Weighted survey estimates of by (household income) against any variable
+	of df, cached per (variable, weight, stat, filters).
+
+	Returns aggregate(variable, weight=None, stat='count', filters=()):
+	stat='count' gives the weighted crosstab (by down, variable across),
+	'proportion' the share of each by value within each variable value and
+	'mean' the weighted mean of by per variable value. weight names a weight
+	column such as V2116, V3080 or WGTPERCY (None counts rows) and filters is
+	a tuple of (column, tuple of values) pairs that rows must match.
+	"""
+	import numpy as np
+
+	@lru_cache(maxsize=None)
+	def aggregate(variable, weight=None, stat='count', filters=()):
+		keep = np.ones(len(df.index), dtype=bool)
+		for col, values in filters:
+			# nullable columns give a BooleanArray, NA where the value is NA
+			keep &= df[col].isin(values).to_numpy(dtype=bool, na_value=False)
+
+		counts, _ = binned_counts(df[variable][keep], df[by][keep], 
+		                          weights=None if weight is None else df[weight][keep])
+
+		if stat == 'count':
+			return counts
+		elif stat == 'proportion':
+			return counts / counts.sum(axis=0)
+		elif stat == 'mean':
+			return counts.mul(counts.index, axis=0).sum() / counts.sum()
+		else:
+			raise ValueError(f"Unknown statistic: {stat}")
+
+	return aggregate
+
+def file_sha256(file, digest=None):
+	"""
+	Feed the contents of file into digest (a fresh sha256 by default).
+	"""
+	if digest is None:
+		digest = hashlib.sha256()
+	with open(file, 'rb') as f:
+		for block in iter(lambda: f.read(1024**2), b''):
+			digest.update(block)
+	return digest
+
+def content_sha256(file, cache_dir='assets/cache'):
+	"""
+	The sha256 of the contents of file, remembered in a sidecar under
+	cache_dir with the size and modification time it was computed for and
+	only recomputed when those change: a lookup is a stat and a tiny read.
+	"""
+	st = os.stat(file)
+	stamp = [os.path.abspath(file), st.st_size, st.st_mtime_ns]
+	sidecar = os.path.join(cache_dir, f"{os.path.basename(file)}.sha256.json")
+	try:
+		with open(sidecar) as f:
+			saved = json.load(f)
+		if saved['stamp'] == stamp:
+			return saved['sha256']
+	except (OSError, ValueError, KeyError):
+		pass
+
+	sha256 = file_sha256(file).hexdigest()
+	# write then rename so concurrent workers never read a partial sidecar
+	os.makedirs(cache_dir, exist_ok=True)
+	tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+	with open(tmp_path, 'w') as f:
+		json.dump({'stamp': stamp, 'sha256': sha256}, f)
+	os.replace(tmp_path, sidecar)
+	return sha256
+
+def source_key(file, params, cache_dir='assets/cache'):
+	"""
+	Hash the contents of file (see content_sha256) together with the
+	parameters that shape the frame built from it, so any change to either
+	gives a new cache entry.
+	"""
+	key = repr((content_sha256(file, cache_dir), sorted(params.items())))
+	return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def stat_key(file, params):
+	"""
+	Like source_key(), but from the size and modification time of file
+	instead of its contents: free to compute however large the file is.
+	"""
+	st = os.stat(file)
+	key = repr((st.st_size, st.st_mtime_ns, sorted(params.items())))
+	return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def export_arrays(df, path):
+	"""
+	Write each column of df as its own .npy file under path, with a manifest
+	describing how to rebuild the frame from them.
+	"""
+	import numpy as np
+	import pandas as pd
+
+	os.makedirs(path)
+	manifest = {'columns': [], 'index': None}
+
+	for i, col in enumerate(df.columns):
+		s = df[col]
+		entry = {'name': col, 'dtype': str(s.dtype)}
+
+		if isinstance(s.dtype, pd.CategoricalDtype):
+			entry['kind'] = 'category'
+			entry['categories'] = s.cat.categories.tolist()
+			np.save(os.path.join(path, f"{i}.npy"), s.cat.codes.to_numpy())
+		elif isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+			entry['kind'] = 'masked'
+			np.save(os.path.join(path, f"{i}.npy"), s.to_numpy(dtype=s.dtype.numpy_dtype, na_value=0))
+			np.save(os.path.join(path, f"{i}.mask.npy"), s.isna().to_numpy())
+		else:
+			entry['kind'] = 'numpy'
+			np.save(os.path.join(path, f"{i}.npy"), s.to_numpy())
+
+		manifest['columns'].append(entry)
+
+	if not df.index.equals(pd.RangeIndex(len(df.index))) or df.index.name is not None:
+		manifest['index'] = df.index.name or ''
+		np.save(os.path.join(path, 'index.npy'), df.index.to_numpy())
+
+	with open(os.path.join(path, 'manifest.json'), 'w') as f:
+		json.dump(manifest, f)
+
+def load_arrays(path, mmap=True):
+	"""
+	Rebuild a frame written by export_arrays on top of read-only memory-mapped
+	arrays. Nothing is copied, so every process that loads the same path
+	shares one set of pages through the OS page cache. With mmap=False the
+	arrays are read into private memory instead.
+	"""
+	import numpy as np
+	import pandas as pd
+
+	with open(os.path.join(path, 'manifest.json')) as f:
+		manifest = json.load(f)
+
+	mmap_mode = 'r' if mmap is True else None
+	data = {}
+	for i, entry in enumerate(manifest['columns']):
+		values = np.load(os.path.join(path, f"{i}.npy"), mmap_mode=mmap_mode)
+
+		if entry['kind'] == 'category':
+			data[entry['name']] = pd.Categorical.from_codes(values, categories=entry['categories'])
+		elif entry['kind'] == 'masked':
+			mask = np.load(os.path.join(path, f"{i}.mask.npy"), mmap_mode=mmap_mode)
+			data[entry['name']] = pd.arrays.IntegerArray(values, mask)
+		else:
+			data[entry['name']] = values
+
+	index = None
+	if manifest['index'] is not None:
+		index = pd.Index(np.load(os.path.join(path, 'index.npy'), mmap_mode=mmap_mode), name=manifest['index'] or None)
+
+	return pd.DataFrame(data, index=index, copy=False)
+
+def cached_frame(file, params, build, cache_dir='assets/cache', output=False, mmap=False):
+	"""
+	Return the frame build() makes from file, persisted under cache_dir as
+	one .npy file per column (see export_arrays) and keyed by source_key().
+	A cache hit is a columnar read instead of a CSV parse, downcast and
+	wrangle, and only rehashes file when its size or mtime have changed.
+
+	With mmap=True the frame is served straight from the mapped files (see
+	load_arrays), so all workers share a single read-only copy; otherwise
+	the arrays are read into memory the frame owns.
+	"""
+	name = f"{os.path.splitext(os.path.basename(file))[0]}-{source_key(file, params, cache_dir)}"
+	path = os.path.join(cache_dir, name)
+
+	if os.path.exists(path):
+		if output is True:
+			print(f"\nLoading cached DataFrame from {path}\n")
+		with metrics.phase('cache_read'):
+			return load_arrays(path, mmap=mmap)
+
+	df = build()
+
+	# write then rename so concurrent workers never read a partial file
+	os.makedirs(cache_dir, exist_ok=True)
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	export_arrays(df, tmp_path)
+	try:
+		os.rename(tmp_path, path)
+	except OSError:
+		# another worker got there first
+		shutil.rmtree(tmp_path)
+
+	if mmap is True:
+		return load_arrays(path)
+	return df
+
+ncvs_small_file = 'assets/files/ncvs_small.csv'
+
+def ncvs_small_columns():
+	"""
+	The columns of the NCVS extract, read from its header alone.
+	"""
+	import pandas as pd
+
+	return list(pd.read_csv(ncvs_small_file, nrows=0).columns)
+
+def ncvs_small(n_samples=None, output=False, wrangle=False, chunksize=None, cache=True, mmap=False, columns=None, safe=True):
+
+    file = ncvs_small_file
+    if columns is None:
+        columns = cols_to_keep
+
+    def build():
+        # safe keeps float columns such as the survey weights exact (see reduce_mem_usage)
+        df = import_data(file, dtypes=compile_schema(), n_samples=n_samples, output=output, 
+                         columns_to_keep=columns, chunksize=chunksize, safe=safe)
+
+        if wrangle is True:
+            with metrics.phase('wrangle'):
+                df = wrangle_nulls(df)
+
+        return df
+
+    if cache is False:
+        return build()
+
+    params = {'n_samples': n_samples, 'wrangle': wrangle, 'cols_to_keep': tuple(columns), 'safe': safe, 
+              'schema': tuple(sorted(compile_schema().items()))}
+    return cached_frame(file, params, build, output=output, mmap=mmap)
+
+# realistic ranges for unlabelled variables whose sentinels say nothing about
+# their values; (low, high) inclusive
+known_ranges = {'V3027': (1992, 2016), 'V3082': (1999, 2016),  # years
+                'V2130': (1, 12), 'V3025': (1, 12), 'V3026': (1, 31),  # months, days
+                'V3013': (12, 90), 'V3014': (12, 90),  # ages: persons 12 and over, top-coded at 90
+                'V3017': (1, 2), 'V3018': (1, 2),  # sex
+                'V3015': (1, 5), 'V3016': (1, 5),  # marital status
+                'V2078': (0, 4), 'V3033': (0, 10), 'V3081': (0, 5),  # counts
+                'V3031': (0, 11), 'V3032': (0, 60), 'V3009': (1, 10), 'V3010': (1, 20)}
+
+# identifiers, generated as one distinct number per row
+id_cols = ('IDHH', 'IDPER', 'V3002', 'V3005')
+
+def variable_domain(col):
+	"""
+	The valid (non-Null) codes of a dataDictionary variable: its labelled
+	codes if it has them, else its known_ranges entry, 1-10 for the "NO.
+	TIMES" incident counts, otherwise 1 up to just below its smallest positive
+	sentinel (e.g. 1-7 for [8, 9]), capped at 1-9.
+
+	That last fallback is only a placeholder: it keeps generated values clear
+	of the sentinels but says nothing about what the variable really holds.
+	"""
+	import numpy as np
+
+	entry = dataDictionary[col]
+	codes = [k for k in entry if isinstance(k, int) and k not in entry['Null']]
+	if codes:
+		return np.array(sorted(codes))
+
+	if col in known_ranges:
+		low, high = known_ranges[col]
+		return np.arange(low, high + 1)
+	if entry.get('Desc', '').startswith('NO. TIMES'):
+		return np.arange(1, 11)
+
+	positive = [k for k in entry['Null'] if k > 1]
+	return np.arange(1, min(positive + [10]))
+
+def generate_ncvs(n_rows, columns=None, seed=0, null_rate=0.05, chunksize=100000):
+	"""
+	Yield synthetic NCVS-shaped frames of up to chunksize rows, n_rows in
+	total, shaped like the raw survey extract (Null codes, not blanks).
+
+	Each coded variable draws from its variable_domain() with skewed, seeded
+	frequencies, and a null_rate share of its rows take one of its "Null"
+	sentinels. YEAR/YEARQ span 1992-2016 (V3027 is the same year, V3003
+	codes it with the quarter as YYYYQ), id_cols count up from 1 across
+	chunks and the weight columns are positive floats. The same seed and
+	chunksize always give the same data.
+	"""
+	import numpy as np
+	import pandas as pd
+
+	if columns is None:
+		columns = list(dataDictionary)
+
+	rng = np.random.default_rng(seed)
+	weights = ('V2116', 'V3080', 'WGTPERCY')
+	generated = weights + id_cols + ('YEAR', 'YEARQ', 'V3003', 'V3027')
+	domains = {col: variable_domain(col) for col in columns if col not in generated}
+	# skewed but fixed frequencies per variable, so modes and crosstabs have shape
+	frequencies = {col: rng.dirichlet(np.ones(len(domain))) for col, domain in domains.items()}
+
+	for chunk_no, start in enumerate(range(0, n_rows, chunksize)):
+		rows = min(chunksize, n_rows - start)
+		rng = np.random.default_rng([seed, chunk_no])
+		data = {}
+
+		years = rng.integers(1992, 2017, rows)
+		quarters = rng.integers(1, 5, rows)
+
+		for col in columns:
+			nulls = dataDictionary[col]['Null']
+			if col in ('YEAR', 'V3027'):
+				values = years
+			elif col == 'YEARQ':
+				values = years + quarters / 10
+			elif col == 'V3003':
+				values = years * 10 + quarters
+			elif col in id_cols:
+				values = np.arange(start + 1, start + rows + 1)
+			elif col in weights:
+				values = np.round(rng.lognormal(7.5, 0.5, rows), 4)
+			else:
+				values = rng.choice(domains[col], size=rows, p=frequencies[col])
+
+			if nulls and col not in weights:
+				values = np.where(rng.random(rows) < null_rate, rng.choice(nulls, rows), values)
+			data[col] = values
+
+		yield pd.DataFrame(data, index=pd.RangeIndex(start, start + rows))
+
+def write_ncvs(file, n_rows, columns=None, seed=0, null_rate=0.05, chunksize=100000, output=False):
+	"""
+	Stream generate_ncvs() chunks straight to file: CSV, or Parquet when
+	file ends in .parquet (needs pyarrow, which the app itself does not).
+	Memory stays at one chunk for any n_rows.
+	"""
+	writer = None
+	written = 0
+
+	try:
+		for chunk in generate_ncvs(n_rows, columns=columns, seed=seed, null_rate=null_rate, chunksize=chunksize):
+			if file.endswith('.parquet'):
+				import pyarrow as pa
+				import pyarrow.parquet as pq
+
+				table = pa.Table.from_pandas(chunk, preserve_index=False)
+				if writer is None:
+					writer = pq.ParquetWriter(file, table.schema)
+				writer.write_table(table)
+			else:
+				chunk.to_csv(file, mode='w' if written == 0 else 'a', header=(written == 0), index=False)
+
+			written += len(chunk.index)
+			if output is True:
+				print(f"Wrote {written} / {n_rows} rows")
+	finally:
+		if writer is not None:
+			writer.close()
+
+	return written
 
 dataDictionary = {"YEAR": 
                           {"Desc": "YEAR",
@@ -640,8 +1218,330 @@ def change_attributes(dicIn, dic_new):
 		dicIn[key] = dic_new[key]
 	return dicIn
 
-def ncvs_small_model():
-	return pickle.load(open('assets/model.sav', 'rb'))
+_models = {}
+_forests = {}
+
+def check_model(file, cache_dir='assets/cache'):
+	"""
+	Return the sha256 of the pickled model in file, after checking it against
+	the one in file + '.sha256' (as written by sha256sum) when that exists.
+	A mismatch raises ValueError before anything is unpickled. The hash is
+	remembered by content_sha256, so it is only recomputed when the model
+	file changes.
+	"""
+	sha256 = content_sha256(file, cache_dir)
+	if os.path.exists(f"{file}.sha256"):
+		with open(f"{file}.sha256") as f:
+			expected = f.read().split()[0].lower()
+		if sha256 != expected:
+			raise ValueError(f"Checksum mismatch for model {file}")
+	return sha256
+
+def ncvs_small_model(file='assets/model.sav', cache_dir='assets/cache'):
+	"""
+	Load the pickled pipeline once per process, after check_model().
+
+	sklearn's trees copy their node arrays when unpickled whatever the
+	container, so a plain pickle.load is the quickest way to the pipeline.
+	Callers that only need the forest's probabilities should use
+	ncvs_small_forest(), which maps the trees from disk instead.
+	"""
+	if file not in _models:
+		with metrics.phase('model_load'):
+			check_model(file, cache_dir)
+			with open(file, 'rb') as f:
+				_models[file] = pickle.load(f)
+	return _models[file]
+
+def ncvs_small_forest(file='assets/model.sav', cache_dir='assets/cache', verify=True):
+	"""
+	The pipeline's random forest as a compile_forest() predict_proba, served
+	from memory-mapped node arrays. Every process on the host shares one copy
+	of the trees through the page cache.
+
+	The arrays are exported to cache_dir the first time, keyed by the
+	pickle's size and mtime, with a sha256 checksum per array and the
+	check_model() hash of the pickle they came from. The first load in each
+	process checks the array checksums and that the pickle still has that
+	hash (verify=False checks the array sizes only). A mismatch raises
+	ValueError.
+	"""
+	if file not in _forests:
+		path = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(file))[0]}-{stat_key(file, {})}.forest")
+		with metrics.phase('model_load'):
+			if not os.path.exists(path):
+				os.makedirs(cache_dir, exist_ok=True)
+				tmp_path = f"{path}.{os.getpid()}.tmp"
+				model = ncvs_small_model(file, cache_dir)
+				export_forest(flatten_forest(model.named_steps['randomforestclassifier']), tmp_path, 
+				              source=check_model(file, cache_dir))
+				try:
+					os.rename(tmp_path, path)
+				except OSError:
+					# another worker got there first
+					shutil.rmtree(tmp_path)
+			source = check_model(file, cache_dir) if verify is True else None
+			_forests[file] = forest_predictor(load_forest(path, verify=verify, source=source))
+	return _forests[file]
+
+def score_frame(model, X):
+	"""
+	Score rows of feature_cols with one predict_proba call, returning the
+	predicted income bracket and its probability for each row.
+	"""
+	import pandas as pd
+
+	metrics.inc('model_calls_total', help='predict_proba calls, by caller.', caller='batch')
+	proba = model.predict_proba(X)
+	return pd.DataFrame({'prediction': model.classes_.take(proba.argmax(axis=1)), 
+	                     'confidence': proba.max(axis=1)}, index=X.index)
+
+def score_chunks(model, chunks):
+	"""
+	Lazily score an iterable of feature frames, one score_frame per chunk, so
+	memory stays bounded by the chunk size however many rows come in. Empty
+	frames are skipped, since predict_proba refuses zero rows.
+	"""
+	for X in chunks:
+		if len(X.index) == 0:
+			continue
+		if list(X.columns) != feature_cols:
+			X = X[feature_cols]
+		yield score_frame(model, X)
+
+def score_chunk(model_file, X):
+	return score_frame(ncvs_small_model(model_file), X)
+
+def score_file(file, out_file, workers=None, chunksize=100000, model_file='assets/model.sav', output=False):
+	"""
+	Score a CSV of respondent profiles in parallel and write the predictions,
+	in input order, to out_file as CSV.
+
+	The file is read chunksize rows at a time and chunks are scored by a pool
+	of workers processes (os.cpu_count() by default). The model is loaded in
+	this process before the pool starts, so forked workers inherit it and
+	others load it once each. At most two chunks per worker are in flight,
+	which keeps memory bounded for any file size.
+	"""
+	from concurrent.futures import ProcessPoolExecutor
+	import pandas as pd
+
+	ncvs_small_model(model_file)
+	workers = workers or os.cpu_count()
+	reader = pd.read_csv(file, usecols=feature_cols, chunksize=chunksize)
+	rows = 0
+
+	with ProcessPoolExecutor(max_workers=workers, initializer=ncvs_small_model, initargs=(model_file,)) as pool, \
+	     open(out_file, 'w', newline='') as out:
+		pending = deque()
+		for X in itertools.chain(reader, [None]):
+			if X is not None:
+				pending.append(pool.submit(score_chunk, model_file, X[feature_cols]))
+			# write finished chunks in order once the window is full, or at the end
+			while pending and (X is None or len(pending) >= 2 * workers):
+				scores = pending.popleft().result()
+				scores.to_csv(out, index=False, header=(rows == 0))
+				rows += len(scores.index)
+				if output is True:
+					print(f"Scored {rows} rows")
+
+	return rows
+
+def flatten_forest(forest):
+	"""
+	Flatten a fitted RandomForestClassifier into one set of node arrays
+	(feature, threshold, children, leaf class probabilities) covering every
+	tree, plus the roots, maximum depth and classes needed to walk them.
+	"""
+	import numpy as np
+	import sklearn
+
+	# before 1.4 trees stored class counts and predict_proba normalized them
+	normalize = tuple(int(part) for part in sklearn.__version__.split('.')[:2]) < (1, 4)
+
+	features, thresholds, lefts, rights, missing_left, values, roots = [], [], [], [], [], [], []
+	offset = 0
+	depth = 0
+
+	for estimator in forest.estimators_:
+		tree = estimator.tree_
+		nodes = np.arange(tree.node_count)
+		leaf = tree.children_left == -1
+
+		# leaves point at themselves so finished rows stay put
+		features.append(np.where(leaf, 0, tree.feature))
+		thresholds.append(tree.threshold)
+		lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+		rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+		missing_left.append(getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)).astype(bool))
+
+		value = tree.value[:, 0, :]
+		if normalize:
+			# same normalization as DecisionTreeClassifier.predict_proba
+			normalizer = value.sum(axis=1)[:, np.newaxis]
+			normalizer[normalizer == 0.0] = 1.0
+			value = value / normalizer
+		values.append(value)
+
+		roots.append(offset)
+		offset += tree.node_count
+		depth = max(depth, tree.max_depth)
+
+	return {'feature': np.concatenate(features), 
+	        'threshold': np.concatenate(thresholds), 
+	        'left': np.concatenate(lefts), 
+	        'right': np.concatenate(rights), 
+	        'missing_left': np.concatenate(missing_left), 
+	        'value': np.concatenate(values), 
+	        'roots': np.array(roots), 
+	        'depth': np.array(depth), 
+	        'classes': np.asarray(forest.classes_)}
+
+def export_forest(arrays, path, source=None):
+	"""
+	Write flatten_forest() arrays as .npy files under path, with a manifest
+	of their sizes and sha256 checksums and of the source (the sha256 of the
+	model they came from) if given.
+	"""
+	import numpy as np
+
+	os.makedirs(path)
+	manifest = {'source': source, 'arrays': {}}
+
+	for name, values in arrays.items():
+		file = os.path.join(path, f"{name}.npy")
+		np.save(file, values)
+		manifest['arrays'][name] = {'bytes': os.path.getsize(file), 'sha256': file_sha256(file).hexdigest()}
+
+	with open(os.path.join(path, 'manifest.json'), 'w') as f:
+		json.dump(manifest, f)
+
+def load_forest(path, verify=False, source=None):
+	"""
+	Map the arrays written by export_forest read-only. Sizes are always
+	checked against the manifest; with verify=True every checksum is too,
+	and with source set the manifest must have been written for it.
+	"""
+	import numpy as np
+
+	with open(os.path.join(path, 'manifest.json')) as f:
+		manifest = json.load(f)
+
+	if source is not None and manifest['source'] != source:
+		raise ValueError(f"Forest arrays {path} were not exported from this model")
+
+	arrays = {}
+	for name, entry in manifest['arrays'].items():
+		file = os.path.join(path, f"{name}.npy")
+		if os.path.getsize(file) != entry['bytes'] or (verify is True and file_sha256(file).hexdigest() != entry['sha256']):
+			raise ValueError(f"Checksum mismatch for forest array {file}")
+		# a plain ndarray view of the map: indexing a np.memmap is slower
+		arrays[name] = np.asarray(np.load(file, mmap_mode='r'))
+
+	return arrays
+
+def forest_predictor(arrays):
+	"""
+	Return a predict_proba(X) over flatten_forest() arrays that walks all
+	trees for all rows at once with NumPy. It skips sklearn's per-call
+	validation and joblib dispatch and matches forest.predict_proba exactly:
+	inputs are compared as float32 like sklearn's trees, and tree outputs
+	are summed in tree order.
+	"""
+	import numpy as np
+
+	feature = arrays['feature']
+	threshold = arrays['threshold']
+	left = arrays['left']
+	right = arrays['right']
+	missing_left = arrays['missing_left']
+	value = arrays['value']
+	roots = arrays['roots']
+	depth = int(arrays['depth'])
+
+	def predict_proba(X):
+		X = np.asarray(X, dtype=np.float32).astype(np.float64)
+		rows = np.arange(X.shape[0])[:, np.newaxis]
+		node = np.broadcast_to(roots, (X.shape[0], len(roots)))
+
+		for _ in range(depth):
+			x = X[rows, feature[node]]
+			go_left = (x <= threshold[node]) | (np.isnan(x) & missing_left[node])
+			node = np.where(go_left, left[node], right[node])
+
+		leaves = value[node]
+		proba = np.zeros((X.shape[0], value.shape[1]))
+		for k in range(len(roots)):
+			proba += leaves[:, k]
+		return proba / len(roots)
+
+	predict_proba.classes_ = np.asarray(arrays['classes'])
+	return predict_proba
+
+def compile_forest(forest):
+	"""
+	forest_predictor() for a fitted RandomForestClassifier held in memory.
+	"""
+	return forest_predictor(flatten_forest(forest))
+
+def cached_predict_proba(predict_proba, maxsize=4096, store=None, store_maxsize=100000):
+	"""
+	Put a bounded LRU cache in front of predict_proba for single rows.
+
+	Features are quantized to an int tuple for the key. When store names a
+	SQLite file, misses fall through to it before the model is asked, so
+	every worker on the host shares one set of answers; it keeps the
+	store_maxsize most recently added rows. Returns a function of one
+	feature sequence giving a tuple of class probabilities, with
+	cache_info() for in-process hits/misses and a stats dict counting store
+	hits and model calls. Safe to call from several threads.
+	"""
+	connections = {}
+	stats = {'store_hits': 0, 'model_calls': 0}
+	# one sqlite connection is shared by the process's threads, one call at a time
+	lock = threading.Lock()
+
+	def connect():
+		# one connection per process; sqlite handles must not cross a fork
+		pid = os.getpid()
+		if pid not in connections:
+			os.makedirs(os.path.dirname(store) or '.', exist_ok=True)
+			db = sqlite3.connect(store, timeout=5, check_same_thread=False)
+			db.execute('CREATE TABLE IF NOT EXISTS proba (features TEXT PRIMARY KEY, proba TEXT)')
+			connections[pid] = db
+		return connections[pid]
+
+	@lru_cache(maxsize=maxsize)
+	def lookup(features):
+		key = json.dumps(features)
+		if store is not None:
+			with lock:
+				row = connect().execute('SELECT proba FROM proba WHERE features = ?', (key,)).fetchone()
+				if row is not None:
+					stats['store_hits'] += 1
+			if row is not None:
+				return tuple(json.loads(row[0]))
+
+		with lock:
+			stats['model_calls'] += 1
+		metrics.inc('model_calls_total', help='predict_proba calls, by caller.', caller='slider')
+		proba = tuple(predict_proba([list(features)])[0].tolist())
+
+		if store is not None:
+			with lock, connect() as db:
+				added = db.execute('INSERT OR IGNORE INTO proba VALUES (?, ?)', (key, json.dumps(proba)))
+				if added.rowcount == 1:
+					# rowids grow with every insert, so this drops the oldest rows
+					db.execute('DELETE FROM proba WHERE rowid <= ?', (added.lastrowid - store_maxsize,))
+		return proba
+
+	def cached(features):
+		return lookup(tuple(int(round(v)) for v in features))
+
+	cached.cache_info = lookup.cache_info
+	cached.cache_clear = lookup.cache_clear
+	cached.stats = stats
+	return cached
 
 def rprint(var):
     print(var)
@@ -0,0 +1,119 @@
+# Imports from 3rd party libraries
+import cProfile
+import itertools
+import json
+import os
+import time
+from flask import Response, abort, g, request
+
+# Imports from this application
+from app import server
+import MyFuncs as mf
+import metrics
+
+# rows scored per predict_proba call
+chunksize = 10000
+# the pickled pipeline that scores them
+model_file = 'assets/model.sav'
+
+def numeric(X):
+    """ The feature columns of X as numbers, or a ValueError naming the first row that isn't. """
+    import pandas as pd
+
+    X = X[mf.feature_cols]
+    try:
+        return X.apply(pd.to_numeric)
+    except (ValueError, TypeError):
+        bad = X.apply(pd.to_numeric, errors='coerce').isna() & X.notna()
+        raise ValueError(f"Row {bad.any(axis=1).idxmax() + 1}: feature values must be numeric")
+
+def json_chunks(X):
+    for start in range(0, len(X.index), chunksize):
+        yield X.iloc[start:start + chunksize]
+
+def json_stream(scored):
+    yield '['
+    for i, scores in enumerate(scored):
+        yield ('' if i == 0 else ',') + json.dumps(scores.to_dict(orient='records'))[1:-1]
+    yield ']'
+
+def csv_stream(scored):
+    rows = 0
+    try:
+        for scores in scored:
+            yield scores.to_csv(index=False, header=(rows == 0))
+            rows += len(scores.index)
+    except ValueError as e:
+        # the status line has gone out, so a bad later chunk ends the body with an error record
+        yield ('prediction,confidence\n' if rows == 0 else '') + f"error,{json.dumps(str(e))}\n"
+        return
+    if rows == 0:
+        # a header-only CSV has no rows to score, like an empty JSON array
+        yield 'prediction,confidence\n'
+
+# Batch scoring: POST a CSV with a header naming mf.feature_cols, or a JSON
+# array of rows in mf.feature_cols order. Scores stream back in the same
+# format, chunk by chunk, one prediction and confidence per input row.
+# Malformed JSON, or a malformed header or first chunk of a CSV, gets a 400;
+# a CSV chunk that fails later ends the stream with an "error,<message>" row.
+@server.route('/api/predict', methods=['POST'])
+def batch_predict():
+    import pandas as pd
+
+    model = mf.ncvs_small_model(model_file)
+
+    if request.mimetype == 'application/json':
+        rows = request.get_json()
+        if not isinstance(rows, list) or any(not isinstance(row, list) or len(row) != len(mf.feature_cols) for row in rows):
+            abort(400, f"Expected an array of rows with {len(mf.feature_cols)} values: {', '.join(mf.feature_cols)}")
+        try:
+            X = numeric(pd.DataFrame(rows, columns=mf.feature_cols, dtype=object))
+        except ValueError as e:
+            abort(400, str(e))
+
+        return Response(json_stream(mf.score_chunks(model, json_chunks(X))), mimetype='application/json')
+
+    try:
+        reader = pd.read_csv(request.stream, chunksize=chunksize)
+        # check the header and first chunk before the response starts streaming
+        first = next(reader, None)
+    except pd.errors.EmptyDataError:
+        abort(400, "Empty CSV")
+    except ValueError as e:
+        abort(400, f"Unreadable CSV: {e}")
+    if first is None:
+        return Response('', mimetype='text/csv')
+    missing = set(mf.feature_cols) - set(first.columns)
+    if missing:
+        abort(400, f"CSV is missing feature columns: {', '.join(sorted(missing))}")
+    try:
+        first = numeric(first)
+    except ValueError as e:
+        abort(400, str(e))
+
+    chunks = itertools.chain([first], (numeric(X) for X in reader))
+    return Response(csv_stream(mf.score_chunks(model, chunks)), mimetype='text/csv')
+
+@server.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Per-request profiling: outside production (server.debug, as with
+# `python run.py`), a request carrying an X-Profile header is run under
+# cProfile and the stats are dumped to profiles/ for snakeviz / pstats.
+@server.before_request
+def start_profile():
+    if server.debug and 'X-Profile' in request.headers:
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+@server.after_request
+def dump_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+        os.makedirs('profiles', exist_ok=True)
+        path = os.path.join('profiles', f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{request.path.strip('/').replace('/', '_') or 'root'}.prof")
+        profile.dump_stats(path)
+        response.headers['X-Profile-Dump'] = path
+    return response
@@ -0,0 +1,137 @@
+# Offline benchmarks for the MyFuncs data pipeline. Every stage runs on
+# synthetic NCVS-shaped data at each row count and reports the peak traced
+# memory of one run and the best wall time of --repeat untraced runs after it;
+# results can be saved as a baseline and later runs compared against it.
+#
+# Runs are compared against bench_baseline.json in the repository root when
+# it exists. Timings are only comparable on the machine they were recorded
+# on, which --save stores next to them, so record the baseline there (e.g.
+# the CI runner) and commit it with the change that moved the numbers.
+#
+#   python bench.py --rows 10000 1000000 10000000   # exit 1 on regression
+#   python bench.py --save bench_baseline.json
+#   python bench.py --baseline other.json --tolerance 0.2
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import MyFuncs as mf
+
+def synthetic_frame(n_rows, seed=0):
+    """ n_rows of the app's columns plus the household weight, from MyFuncs.generate_ncvs. """
+    return pd.concat(mf.generate_ncvs(n_rows, columns=mf.cols_to_keep + ['V2116'], seed=seed, chunksize=1000000))
+
+def measure(func, repeat=1):
+    """ Run func once under tracemalloc, which also warms it up, then repeat
+    times untraced, returning its result, the peak traced bytes and the
+    lowest seconds taken (so one noisy run can't flag a regression).
+    Tracing slows allocation-heavy stages down, so it never overlaps a
+    timed run. """
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return result, best_seconds, peak
+
+def machine():
+    """ What a baseline's timings depend on, saved alongside them. """
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(), 
+            'cpus': os.cpu_count(), 'python': platform.python_version(), 'pandas': pd.__version__}
+
+def run_stages(n_rows, workdir, repeat=1):
+    """ Time every pipeline stage on n_rows rows, best of repeat runs each. """
+    results = {}
+    df = synthetic_frame(n_rows)
+    os.makedirs(os.path.join(workdir, 'assets', 'files'), exist_ok=True)
+    csv = os.path.join(workdir, 'assets', 'files', 'ncvs_small.csv')
+    df.to_csv(csv, index=False)
+
+    stages = [
+        ('sample_data', lambda: mf.sample_data(df, n_rows // 10)),
+        ('sample_data_random', lambda: mf.sample_data(df, n_rows // 10, method='random', seed=0)),
+        ('reduce_mem_usage', lambda: mf.reduce_mem_usage(df.copy())),
+        ('import_data', lambda: mf.import_data(csv, columns_to_keep=mf.cols_to_keep)),
+        ('import_data_chunked', lambda: mf.import_data(csv, columns_to_keep=mf.cols_to_keep, chunksize=100000)),
+        ('ncvs_small', lambda: mf.ncvs_small(wrangle=True, cache=False)),
+        ('ncvs_small_cached', lambda: mf.ncvs_small(wrangle=True, mmap=True)),
+    ]
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # fill the cache so ncvs_small_cached measures a hit
+        mf.ncvs_small(wrangle=True, mmap=True)
+        for name, func in stages:
+            frame, seconds, peak = measure(func, repeat)
+            results[name] = {'seconds': seconds, 'peak_mb': peak / 1024**2}
+
+        data = frame
+        _, seconds, peak = measure(lambda: [mf.binned_counts(data[col], data['V2026']) for col in mf.feature_cols], repeat)
+        results['heatmap_counts'] = {'seconds': seconds, 'peak_mb': peak / 1024**2}
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+def regressions(results, baseline, tolerance, floors={'seconds': 0.01, 'peak_mb': 0.5}):
+    """ Stages that grew by more than tolerance and by more than the absolute
+    floor, which keeps sub-millisecond stages from flagging on timer noise. """
+    found = []
+    for rows, stages in results.items():
+        for stage, numbers in stages.items():
+            before = baseline.get(rows, {}).get(stage)
+            if before is None:
+                continue
+            for key in ('seconds', 'peak_mb'):
+                if numbers[key] > before[key] * (1 + tolerance) and numbers[key] - before[key] > floors[key]:
+                    found.append(f"{stage} @ {rows} rows: {key} {before[key]:.3f} -> {numbers[key]:.3f}")
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the MyFuncs data pipeline on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 1000000, 10000000], help='row counts to run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the best is reported')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default='bench_baseline.json', help='JSON file from an earlier --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown or growth before flagging')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.rows:
+            results[str(n_rows)] = run_stages(n_rows, workdir, args.repeat)
+            print(f"\n{n_rows} rows")
+            for stage, numbers in results[str(n_rows)].items():
+                print(f"  {stage:<22} {numbers['seconds']:9.3f} s {numbers['peak_mb']:10.1f} MB")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': machine(), 'results': results}, f, indent=2, sort_keys=True)
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline} yet, nothing compared; record one on this machine with --save {args.baseline}")
+    elif args.save != args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != machine():
+            print(f"\nWARNING {args.baseline} was recorded on another machine, so its timings may not compare: {baseline['machine']}")
+        found = regressions(results, baseline['results'], args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
@@ -0,0 +1,341 @@
+# Regression checks for behaviour the pipeline promises but nothing else
+# verifies: each check builds small synthetic inputs, so they run anywhere
+# the app's dependencies are installed, without assets/.
+#
+#   python checks.py            # run every check
+#   python checks.py chunked    # only checks whose name contains "chunked"
+import argparse
+import os
+import sys
+import tempfile
+import traceback
+
+import pandas as pd
+
+import MyFuncs as mf
+
+def check_chunked_import_matches_single_read():
+    """ import_data(chunksize=k) gives the same frame as one read, in safe
+    mode too. """
+    with tempfile.TemporaryDirectory() as workdir:
+        csv = os.path.join(workdir, 'ncvs.csv')
+        df = pd.concat(mf.generate_ncvs(25000, columns=mf.cols_to_keep + ['V2116'], seed=1, chunksize=10000))
+        # text columns, so categories are merged across chunks too: a few
+        # labels, and one distinct string per row that safe mode keeps as object
+        df['LABEL'] = df['V2026'].map(mf.dataDictionary['V2026'])
+        df['KEY'] = 'row-' + df.index.astype(str)
+        df.to_csv(csv, index=False)
+        columns = mf.cols_to_keep + ['V2116', 'LABEL', 'KEY']
+
+        for dtypes in (None, mf.compile_schema()):
+            for safe in (False, True):
+                single = mf.import_data(csv, dtypes=dtypes, columns_to_keep=columns, safe=safe)
+                if safe is True:
+                    assert single['KEY'].dtype == object and isinstance(single['LABEL'].dtype, pd.CategoricalDtype)
+                for chunksize in (1000, 7777, 100000):
+                    chunked = mf.import_data(csv, dtypes=dtypes, columns_to_keep=columns, chunksize=chunksize, safe=safe)
+                    pd.testing.assert_frame_equal(chunked, single)
+
+def check_sample_data_sizes_and_strata():
+    """ sample_data returns exactly n_samples rows in strided and random mode,
+    keeps every stratum (small and NaN ones too) in stratified mode and is
+    reproducible from its seed. """
+    import numpy as np
+
+    df = pd.DataFrame({'x': np.arange(1003),
+                       'stratum': [1.0] * 950 + [2.0] * 40 + [3.0] * 3 + [np.nan] * 10})
+
+    for method in ('strided', 'random'):
+        for n in (0, 1, 7, 10, 100, 334, 501, 1003, 5000):
+            sample = mf.sample_data(df, n, method=method, seed=0)
+            assert len(sample.index) == min(n, len(df.index)), (method, n, len(sample.index))
+            assert sample['x'].is_monotonic_increasing and sample['x'].is_unique
+
+    for n in (1, 10, 100, 500):
+        sample = mf.sample_data(df, n, method='stratified', seed=0, stratify='stratum')
+        counts = sample['stratum'].value_counts(dropna=False)
+        assert len(counts) == 4, (n, counts)
+        # every stratum gets its floor share plus at most the rounding row, or at least one
+        for value, size in df['stratum'].value_counts(dropna=False).items():
+            quota = counts[value]
+            assert 1 <= quota <= max(int(np.ceil(size * n / len(df.index))), 1) and quota <= size, (n, value, quota)
+        assert len(sample.index) >= n
+        assert sample['x'].is_monotonic_increasing
+
+    for method, kwargs in (('random', {}), ('stratified', {'stratify': 'stratum'})):
+        first = mf.sample_data(df, 100, method=method, seed=5, **kwargs)
+        pd.testing.assert_frame_equal(first, mf.sample_data(df, 100, method=method, seed=5, **kwargs))
+        assert not first.index.equals(mf.sample_data(df, 100, method=method, seed=6, **kwargs).index)
+
+    assert mf.sample_data(df.iloc[:0], 10, method='stratified', seed=0, stratify='stratum').empty
+
+def check_exported_arrays_round_trip():
+    """ load_arrays rebuilds exactly the frame export_arrays wrote, mapped or
+    read into memory. """
+    import numpy as np
+
+    df = pd.DataFrame({'int': np.arange(6, dtype=np.int16),
+                       'float': [0.5, np.nan, 2.0, 3.25, -1.0, 1e10],
+                       'flag': [True, False, True, True, False, False],
+                       'nullable': pd.array([1, None, 3, None, 5, 6], dtype='Int8'),
+                       'label': pd.Categorical(['a', 'b', None, 'a', 'c', 'b'])},
+                      index=pd.Index([10, 11, 12, 20, 21, 22], name='row'))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for i, frame in enumerate((df, df.reset_index(drop=True), df.iloc[:0])):
+            path = os.path.join(workdir, str(i))
+            mf.export_arrays(frame, path)
+            for mmap in (True, False):
+                loaded = mf.load_arrays(path, mmap=mmap)
+                pd.testing.assert_frame_equal(loaded, frame)
+                values = loaded['int'].to_numpy()
+                while values is not None and not isinstance(values, np.memmap):
+                    values = values.base
+                assert (values is not None) == mmap
+
+def check_binned_counts_without_rows():
+    """ binned_counts copes with inputs that are empty or all missing. """
+    for x, y in ((pd.Series([], dtype='Int8'), pd.Series([], dtype='Int8')), 
+                 (pd.Series([1, pd.NA], dtype='Int8'), pd.Series([pd.NA, 2], dtype='Int8'))):
+        counts, z_range = mf.binned_counts(x, y)
+        assert counts.empty and z_range == [0, 0]
+
+def check_filtered_weighted_aggregates():
+    """ survey_aggregates filters on nullable columns, keeps weights exact and
+    leaves out persons whose weight is the out-of-universe 0. """
+    with tempfile.TemporaryDirectory() as workdir:
+        csv = os.path.join(workdir, 'ncvs.csv')
+        raw = pd.concat(mf.generate_ncvs(20000, columns=mf.cols_to_keep + ['V2116', 'WGTPERCY'], seed=2))
+        raw.loc[raw.index % 10 == 0, 'WGTPERCY'] = 0
+        raw.to_csv(csv, index=False)
+        raw = pd.read_csv(csv)
+        df = mf.wrangle_nulls(mf.import_data(csv, dtypes=mf.compile_schema(), safe=True))
+        assert (df['V2116'] == raw['V2116']).all(), "weights changed on import"
+        assert (df['WGTPERCY'].isna() == (raw['WGTPERCY'] == 0)).all()
+
+        aggregate = mf.survey_aggregates(df)
+        filters = (('V2015', (1, 2)), ('V2024', (1, 2, 3, 4)))
+        counts = aggregate('V3017', weight='V2116', filters=filters)
+
+        keep = df['V2015'].isin((1, 2)).fillna(False) & df['V2024'].isin((1, 2, 3, 4)).fillna(False)
+        expected = df[keep].dropna(subset=['V3017', 'V2026']).groupby(['V2026', 'V3017'])['V2116'].sum().unstack(fill_value=0)
+        pd.testing.assert_frame_equal(counts, expected.astype(float), check_names=False, check_index_type=False, 
+                                      check_column_type=False)
+
+        assert aggregate('V3017', filters=(('V2015', (7,)),)).empty
+
+        persons = aggregate('V3017', weight='WGTPERCY')
+        counted = df.dropna(subset=['V3017', 'V2026', 'WGTPERCY'])
+        assert abs(persons.values.sum() - counted['WGTPERCY'].astype(float).sum()) < 1e-9 * persons.values.sum()
+        assert (df['WGTPERCY'].isna() & df['V3017'].notna() & df['V2026'].notna()).any()
+
+def check_prediction_store_window_and_threads():
+    """ cached_predict_proba's SQLite store keeps the store_maxsize newest
+    rows, is shared between instances and stays consistent under threads. """
+    import json
+    import sqlite3
+    import threading
+    import numpy as np
+
+    calls = []
+    def predict_proba(rows):
+        calls.append(rows[0])
+        return np.array([[rows[0][0] / 1000, 1 - rows[0][0] / 1000]])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store = os.path.join(workdir, 'predictions.sqlite')
+
+        first = mf.cached_predict_proba(predict_proba, store=store, store_maxsize=50)
+        for i in range(200):
+            assert first([i, 1.2]) == (i / 1000, 1 - i / 1000)
+        with sqlite3.connect(store) as db:
+            kept = sorted(json.loads(key)[0] for (key,) in db.execute('SELECT features FROM proba'))
+        assert kept == list(range(150, 200)), kept
+
+        # another worker answers the newest rows from the store, the evicted ones from the model
+        second = mf.cached_predict_proba(predict_proba, store=store, store_maxsize=50)
+        del calls[:]
+        for i in list(range(150, 200)) + list(range(100, 150)):
+            assert second([i, 1]) == (i / 1000, 1 - i / 1000)
+        assert second.stats == {'store_hits': 50, 'model_calls': 50} and len(calls) == 50
+
+        # no in-process cache, so every call goes through the shared connection and lock
+        shared = mf.cached_predict_proba(predict_proba, maxsize=0, store=store, store_maxsize=50)
+        errors = []
+        def worker(n):
+            try:
+                for i in range(300):
+                    value = (i * 7 + n) % 120
+                    assert shared([value, 0]) == (value / 1000, 1 - value / 1000)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors, errors
+        assert shared.stats['store_hits'] + shared.stats['model_calls'] == 8 * 300
+        with sqlite3.connect(store) as db:
+            assert db.execute('SELECT COUNT(*) FROM proba').fetchone()[0] == 50
+
+def check_compiled_forest_matches_sklearn():
+    """ compile_forest, and the forest arrays mapped back from disk, give
+    exactly forest.predict_proba, rows with missing values included. """
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+
+    df = pd.concat(mf.generate_ncvs(5000, columns=mf.cols_to_keep, seed=3))
+    df = mf.wrangle_nulls(df.astype(float))
+    X, y = df[mf.feature_cols].to_numpy(), df['V2026'].fillna(0).to_numpy()
+
+    forest = RandomForestClassifier(n_estimators=20, max_depth=10, random_state=0)
+    try:
+        forest.fit(X, y)
+    except ValueError:
+        # scikit-learn before 1.4 has no missing-value support in trees
+        X = np.nan_to_num(X)
+        forest.fit(X, y)
+
+    expected = forest.predict_proba(X)
+    assert np.array_equal(mf.compile_forest(forest)(X), expected)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'model.forest')
+        mf.export_forest(mf.flatten_forest(forest), path)
+        mapped = mf.forest_predictor(mf.load_forest(path, verify=True))
+        assert np.array_equal(mapped(X), expected)
+        assert np.array_equal(mapped.classes_, forest.classes_)
+
+def small_pipeline(seed=4):
+    """ A small imputer + forest pipeline shaped like assets/model.sav, and the
+    feature frame it was fitted on. """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import make_pipeline
+
+    df = mf.wrangle_nulls(pd.concat(mf.generate_ncvs(2000, columns=mf.cols_to_keep, seed=seed)).astype(float))
+    X, y = df[mf.feature_cols], df['V2026'].fillna(0)
+    model = make_pipeline(SimpleImputer(), RandomForestClassifier(n_estimators=5, max_depth=6, random_state=0))
+    return model.fit(X, y), X
+
+def check_model_checksums():
+    """ ncvs_small_model refuses a model that doesn't match its .sha256 file,
+    and ncvs_small_forest refuses arrays that were changed on disk or
+    exported from another model. """
+    import hashlib
+    import pickle
+    import numpy as np
+
+    model, X = small_pipeline()
+
+    def forget(file):
+        mf._models.pop(file, None)
+        mf._forests.pop(file, None)
+
+    def refused(load, file, **kwargs):
+        forget(file)
+        try:
+            load(file, **kwargs)
+        except ValueError:
+            return True
+        return False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        file, cache_dir = os.path.join(workdir, 'model.sav'), os.path.join(workdir, 'cache')
+        with open(file, 'wb') as f:
+            pickle.dump(model, f)
+        with open(file, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        with open(f"{file}.sha256", 'w') as f:
+            f.write(f"{sha256}  model.sav\n")
+
+        forget(file)
+        proba = mf.ncvs_small_forest(file, cache_dir=cache_dir)
+        assert np.array_equal(proba(model[0].transform(X)), model.predict_proba(X))
+
+        # a damaged array: same size, different bytes
+        forest_dir = next(os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.forest'))
+        with open(os.path.join(forest_dir, 'threshold.npy'), 'r+b') as f:
+            f.seek(-8, os.SEEK_END)
+            f.write(b'\xff' * 8)
+        assert refused(mf.ncvs_small_forest, file, cache_dir=cache_dir)
+        assert not refused(mf.ncvs_small_forest, file, cache_dir=cache_dir, verify=False)
+
+        # a model that no longer matches its published checksum
+        with open(f"{file}.sha256", 'w') as f:
+            f.write('0' * 64)
+        assert refused(mf.ncvs_small_model, file, cache_dir=cache_dir)
+        assert refused(mf.ncvs_small_forest, file, cache_dir=cache_dir)
+        forget(file)
+
+def check_batch_api_errors():
+    """ /api/predict answers 400 for input it can reject before streaming,
+    ends a CSV stream with an error record for a bad later chunk and scores
+    zero rows as an empty result in both formats. """
+    import json
+    import pickle
+    import api
+    import run
+
+    model, _ = small_pipeline()
+    client = run.server.test_client()
+    header = ','.join(mf.feature_cols) + '\n'
+    row = ','.join(['1'] * len(mf.feature_cols)) + '\n'
+    bad = ','.join(['x'] + ['1'] * (len(mf.feature_cols) - 1)) + '\n'
+
+    def post(**kwargs):
+        response = client.post('/api/predict', **kwargs)
+        return response.status_code, response.get_data(as_text=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        saved = api.model_file, api.chunksize
+        api.model_file = os.path.join(workdir, 'model.sav')
+        with open(api.model_file, 'wb') as f:
+            pickle.dump(model, f)
+        try:
+            status, body = post(json=[[1] * len(mf.feature_cols)] * 3)
+            assert status == 200 and len(json.loads(body)) == 3, (status, body)
+            assert post(json=[]) == (200, '[]')
+            assert post(json=[[1, 2]])[0] == 400
+            assert post(json={'rows': []})[0] == 400
+            status, body = post(json=[[1] * len(mf.feature_cols), ['a'] * len(mf.feature_cols)])
+            assert status == 400 and 'Row 2: feature values must be numeric' in body, body
+
+            assert post(data=header, content_type='text/csv') == (200, 'prediction,confidence\n')
+            assert post(data='', content_type='text/csv')[0] == 400
+            assert post(data='a,b\n1,2\n', content_type='text/csv')[0] == 400
+            status, body = post(data=header + row + bad, content_type='text/csv')
+            assert status == 400 and 'Row 2: feature values must be numeric' in body, body
+
+            api.chunksize = 2
+            status, body = post(data=header + row * 4 + bad + row, content_type='text/csv')
+            lines = body.splitlines()
+            assert status == 200 and lines[0] == 'prediction,confidence' and len(lines) == 6, body
+            assert lines[-1] == 'error,"Row 5: feature values must be numeric"', body
+        finally:
+            api.model_file, api.chunksize = saved
+            mf._models.pop(os.path.join(workdir, 'model.sav'), None)
+
+checks = [(name[len('check_'):], func) for name, func in list(globals().items()) if name.startswith('check_')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the pipeline regression checks.')
+    parser.add_argument('only', nargs='*', help='run only checks whose name contains one of these')
+    args = parser.parse_args()
+
+    failed = 0
+    for name, func in checks:
+        if args.only and not any(part in name for part in args.only):
+            continue
+        try:
+            func()
+            print(f"ok      {name}")
+        except Exception:
+            failed += 1
+            print(f"FAILED  {name}")
+            traceback.print_exc()
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,60 @@
+# Cold-start import budget: times `import run` (what a fresh gunicorn worker
+# does before it can serve) in a clean interpreter with -X importtime, and
+# reports where the time goes by top-level package.
+#
+#   python coldstart.py                          # report
+#   python coldstart.py --save coldstart.json    # record the current numbers
+#   python coldstart.py --budget-ms 800          # exit 1 if over budget
+import argparse
+import json
+import subprocess
+import sys
+
+def import_times(module):
+    """ Self time per imported module, in microseconds, plus the total. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        times[name] = int(self_us)
+        if name == module:
+            total = int(cumulative_us)
+    return times, total
+
+def by_package(times):
+    packages = {}
+    for name, us in times.items():
+        root = name.split('.')[0]
+        packages[root] = packages.get(root, 0) + us
+    return packages
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the import cost of the app.')
+    parser.add_argument('--module', default='run', help='module a worker imports (default: run)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the fastest of')
+    parser.add_argument('--top', type=int, default=15, help='packages to list')
+    parser.add_argument('--save', help='write the numbers to this JSON file')
+    parser.add_argument('--budget-ms', type=float, help='fail if the total import time exceeds this')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    times, total = min(runs, key=lambda run: run[1])
+    packages = by_package(times)
+
+    print(f"import {args.module}: {total / 1000:.1f} ms (fastest of {args.repeat})")
+    for name, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<32} {us / 1000:8.1f} ms")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'module': args.module, 'total_ms': total / 1000,
+                       'packages_ms': {name: us / 1000 for name, us in packages.items()}}, f, indent=2, sort_keys=True)
+
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        print(f"over budget: {total / 1000:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
@@ -0,0 +1,18 @@
+# Synthetic NCVS data at any scale, for load tests and benchmarks:
+#   python generate.py assets/files/ncvs_small.csv 10000000 --seed 0 --null-rate 0.05
+#   python generate.py ncvs.parquet 10000000 --columns YEAR V2026 V3013
+import argparse
+
+import MyFuncs as mf
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic NCVS-shaped data generated from MyFuncs.dataDictionary.')
+    parser.add_argument('file', help='output file; .parquet writes Parquet (needs pyarrow), anything else CSV')
+    parser.add_argument('rows', type=int, help='number of rows to generate')
+    parser.add_argument('--columns', nargs='+', default=None, help='dataDictionary variables to include (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--null-rate', type=float, default=0.05, help="share of each coded column set to one of its Null codes")
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows generated and written at a time')
+    args = parser.parse_args()
+
+    mf.write_ncvs(args.file, args.rows, columns=args.columns, seed=args.seed, null_rate=args.null_rate, chunksize=args.chunksize, output=True)
@@ -0,0 +1,16 @@
+# Gunicorn settings: https://docs.gunicorn.org/en/stable/settings.html
+import gc
+
+# Import run:server once in the master, and load the model and the NCVS
+# data there too, so workers are forked with everything already in memory.
+preload_app = True
+
+def when_ready(server):
+    # run.py imports pages lazily; load the heavy one now, before forking
+    from pages import index
+
+    index.warm_up()
+
+    # Keep the loaded objects out of the collector so workers don't touch
+    # (and copy) the shared pages while scanning them.
+    gc.freeze()
@@ -0,0 +1,224 @@
+# Local load test for the Dash callbacks: starts `gunicorn run:server` with
+# the given worker count, then replays visitor traffic against
+# /_dash-update-component at each concurrency level (dropdown changes on
+# plot_against_income and slider sweeps across input-0..input-14) and reports
+# throughput, p50/p95/p99 latency and the memory of every worker.
+#
+#   python loadtest.py --workers 2 --concurrency 1 2 4 8 16 --duration 30
+#   python loadtest.py --url http://127.0.0.1:8050 --concurrency 4    # an already running server
+#   python loadtest.py --save loadtest.json
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+
+predict_output = '..predict_content.children...predict_confidence.children..'
+
+def post(url, body, timeout=60):
+    request = urllib.request.Request(url + '/_dash-update-component', data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+def wait_until_up(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + '/', timeout=5).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout} s")
+
+def find_components(node, found):
+    """ Collect every component with an id from a serialized layout. """
+    if isinstance(node, dict):
+        props = node.get('props', {})
+        if 'id' in props:
+            found[props['id']] = props
+        for value in props.values():
+            find_components(value, found)
+    elif isinstance(node, list):
+        for child in node:
+            find_components(child, found)
+    return found
+
+def page_controls(url):
+    """ Slider ranges and dropdown options, from the index page layout the browser receives. """
+    body = {'output': 'page-content.children', 'outputs': {'id': 'page-content', 'property': 'children'},
+            'inputs': [{'id': 'url', 'property': 'pathname', 'value': '/'}], 'changedPropIds': ['url.pathname']}
+    layout = json.loads(post(url, body))['response']['page-content']['children']
+    components = find_components(layout, {})
+
+    sliders = []
+    while f"input-{len(sliders)}" in components:
+        props = components[f"input-{len(sliders)}"]
+        sliders.append((props['min'], props['max'], props['value']))
+    options = [option['value'] for option in components['plot_against_income']['options']]
+    return sliders, options
+
+def dropdown_body(value):
+    return {'output': 'analysis_content.children', 'outputs': {'id': 'analysis_content', 'property': 'children'},
+            'inputs': [{'id': 'plot_against_income', 'property': 'value', 'value': value}],
+            'changedPropIds': ['plot_against_income.value']}
+
+def slider_body(values, changed):
+    return {'output': predict_output,
+            'outputs': [{'id': 'predict_content', 'property': 'children'},
+                        {'id': 'predict_confidence', 'property': 'children'}],
+            'inputs': [{'id': f"input-{i}", 'property': 'value', 'value': v} for i, v in enumerate(values)],
+            'changedPropIds': [f"input-{changed}.value"]}
+
+def visitor(sliders, options, dropdown_share, rng):
+    """ Endless (kind, body) requests from one visitor: mostly slider sweeps
+    from where the sliders currently sit, now and then a dropdown change. """
+    values = [default for _, _, default in sliders]
+    while True:
+        if rng.random() < dropdown_share:
+            yield 'dropdown', dropdown_body(rng.choice(options))
+            continue
+        i = rng.randrange(len(sliders))
+        low, high, _ = sliders[i]
+        target = rng.randint(low, high)
+        step = 1 if target >= values[i] else -1
+        for v in range(values[i] + step, target + step, step):
+            values[i] = v
+            yield 'slider', slider_body(values, i)
+
+def run_level(url, concurrency, duration, sliders, options, dropdown_share, seed):
+    """ concurrency visitors for duration seconds; per-kind latencies and error counts. """
+    latencies = {'dropdown': [], 'slider': []}
+    errors = {'dropdown': 0, 'slider': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def user(n):
+        requests = visitor(sliders, options, dropdown_share, random.Random(seed * 1000 + n))
+        while time.monotonic() < deadline:
+            kind, body = next(requests)
+            start = time.perf_counter()
+            try:
+                post(url, body)
+                ok = True
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                ok = False
+            seconds = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[kind].append(seconds)
+                else:
+                    errors[kind] += 1
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - start
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(latencies, errors, elapsed):
+    every = latencies['dropdown'] + latencies['slider']
+    summary = {'requests': len(every), 'errors': sum(errors.values()), 'rps': len(every) / elapsed}
+    for kind, values in [('all', every)] + list(latencies.items()):
+        summary[kind] = {'count': len(values), 'p50_ms': percentile(values, 0.50) * 1000,
+                         'p95_ms': percentile(values, 0.95) * 1000, 'p99_ms': percentile(values, 0.99) * 1000}
+    return summary
+
+def worker_pids(master):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name may contain spaces; ppid is the second field after it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master:
+            pids.append(int(entry))
+    return sorted(pids)
+
+def memory_mb(pid):
+    """ RSS and PSS of a process in MB; PSS splits the pages shared with the
+    preloaded master between everyone mapping them. """
+    sizes = {}
+    for path, fields in ((f"/proc/{pid}/status", ('VmRSS',)), (f"/proc/{pid}/smaps_rollup", ('Pss',))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in fields:
+                        sizes[key] = int(value.split()[0]) / 1024
+        except OSError:
+            pass
+    return {'rss_mb': sizes.get('VmRSS', float('nan')), 'pss_mb': sizes.get('Pss', float('nan'))}
+
+def start_server(workers, port, timeout):
+    command = ['gunicorn', 'run:server', '--config', 'gunicorn.conf.py',
+               '--workers', str(workers), '--bind', f"127.0.0.1:{port}", '--timeout', str(timeout)]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the Dash callbacks at increasing concurrency.')
+    parser.add_argument('--url', help='test this running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers to start')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='simultaneous visitors per level')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per concurrency level')
+    parser.add_argument('--dropdown-share', type=float, default=0.1, help='share of requests that change the dropdown')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--startup-timeout', type=float, default=180, help='seconds to wait for the server to load')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server(args.workers, args.port, int(args.startup_timeout))
+        url = f"http://127.0.0.1:{args.port}"
+    url = url.rstrip('/')
+
+    results = {'workers': None if server is None else args.workers, 'levels': {}}
+    try:
+        wait_until_up(url, args.startup_timeout)
+        sliders, options = page_controls(url)
+        print(f"{url}: {len(sliders)} sliders, {len(options)} dropdown options")
+
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = run_level(url, concurrency, args.duration, sliders, options,
+                                                   args.dropdown_share, args.seed)
+            summary = summarize(latencies, errors, elapsed)
+            if server is not None:
+                summary['workers'] = {pid: memory_mb(pid) for pid in worker_pids(server.pid)}
+            results['levels'][str(concurrency)] = summary
+
+            print(f"\nconcurrency {concurrency}: {summary['requests']} requests, {summary['errors']} errors, {summary['rps']:.1f} req/s")
+            for kind in ('all', 'slider', 'dropdown'):
+                numbers = summary[kind]
+                print(f"  {kind:<9} {numbers['count']:7d}   p50 {numbers['p50_ms']:8.1f} ms   p95 {numbers['p95_ms']:8.1f} ms   p99 {numbers['p99_ms']:8.1f} ms")
+            for pid, memory in summary.get('workers', {}).items():
+                print(f"  worker {pid:<7} rss {memory['rss_mb']:8.1f} MB   pss {memory['pss_mb']:8.1f} MB")
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,98 @@
+"""
+In-process timings and counters, rendered in the Prometheus text format.
+
+Each gunicorn worker keeps its own numbers; api.py serves them on /metrics,
+so every scrape reports the worker that answered it (see the pid label).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}    # callback name -> [bucket counts..., +Inf count, sum]
+_counters = {}      # (metric, labels) -> total, or a callable giving it
+_gauges = {}        # (metric, labels) -> callable giving the current value
+_help = {}
+
+def observe(name, seconds):
+    """ Record one callback duration in the callback_seconds histogram. """
+    with _lock:
+        hist = _histograms.setdefault(name, [0] * (len(buckets) + 1) + [0.0])
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[len(buckets)] += 1
+        hist[-1] += seconds
+
+def timed(name):
+    """ Decorator timing every call of a function as callback_seconds{callback=name}. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def inc(metric, value=1, help='', **labels):
+    """ Add value to the counter metric{labels}. """
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _help.setdefault(metric, help)
+
+@contextmanager
+def phase(name):
+    """ Add the time spent in the block to phase_seconds_total{phase=name}. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        inc('phase_seconds_total', time.perf_counter() - start,
+            help='Time spent loading data and models, by phase.', phase=name)
+
+def counter(metric, func, help='', **labels):
+    """ Report func(), a running total kept elsewhere, as the counter metric{labels}. """
+    with _lock:
+        _counters[(metric, tuple(sorted(labels.items())))] = func
+        _help.setdefault(metric, help)
+
+def gauge(metric, func, help='', **labels):
+    """ Report func() as metric{labels} on every scrape. """
+    with _lock:
+        _gauges[(metric, tuple(sorted(labels.items())))] = func
+        _help.setdefault(metric, help)
+
+def render():
+    """ All metrics in the Prometheus text exposition format. """
+    pid = os.getpid()
+    lines = []
+
+    with _lock:
+        if _histograms:
+            lines += ['# HELP callback_seconds Time spent in each callback.', '# TYPE callback_seconds histogram']
+        for name, hist in sorted(_histograms.items()):
+            for i, bound in enumerate(buckets):
+                lines.append(f'callback_seconds_bucket{{callback="{name}",le="{bound}",pid="{pid}"}} {hist[i]}')
+            lines.append(f'callback_seconds_bucket{{callback="{name}",le="+Inf",pid="{pid}"}} {hist[len(buckets)]}')
+            lines.append(f'callback_seconds_sum{{callback="{name}",pid="{pid}"}} {hist[-1]}')
+            lines.append(f'callback_seconds_count{{callback="{name}",pid="{pid}"}} {hist[len(buckets)]}')
+
+        for kind, metrics in (('counter', _counters), ('gauge', _gauges)):
+            seen = set()
+            for (metric, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+                if metric not in seen:
+                    seen.add(metric)
+                    lines += [f'# HELP {metric} {_help.get(metric, "")}', f'# TYPE {metric} {kind}']
+                value = value() if callable(value) else value
+                labels = ''.join(f'{k}="{v}",' for k, v in labels)
+                lines.append(f'{metric}{{{labels}pid="{pid}"}} {value}')
+
+    return '\n'.join(lines) + '\n'
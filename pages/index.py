@@ -1,23 +1,32 @@
 # Imports from 3rd party libraries
-import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-import plotly.express as px
+import plotly.graph_objs as go
 import MyFuncs as mf
-from sklearn.linear_model import LinearRegression
-from sklearn.pipeline import make_pipeline
+import metrics
 import numpy as np
-import pandas as pd
+from functools import lru_cache
+import json
+import os
 
 # of note: dcc.Markdown("<Markdown>")
 
-# Imports from this application
-from app import app
+forest_proba = mf.ncvs_small_forest()
+# PREDICTION_STORE=1 shares slider predictions between workers through a SQLite file
+store = None
+if os.environ.get('PREDICTION_STORE'):
+    store = f"assets/cache/predictions-{mf.stat_key('assets/model.sav', {})}.sqlite"
+predict_proba = mf.cached_predict_proba(forest_proba, store=store)
+# the extract has a row per person, so the person weight turns the heatmaps into
+# estimates of persons (the household weight would count a household once per
+# member); wrangling turns its out-of-universe 0 into NA, which isn't counted
+weight = next((col for col in ('WGTPERCY', 'V3080') if col in mf.ncvs_small_columns()), None)
+_data = mf.ncvs_small(wrangle=True, mmap=True, columns=mf.cols_to_keep + ([weight] if weight else []))
 
-model = mf.ncvs_small_model()
-_data = mf.ncvs_small(wrangle=True)
+metrics.counter('prediction_cache_hits_total', lambda: predict_proba.cache_info().hits, help='Slider predictions served by the in-process LRU cache.')
+metrics.counter('prediction_cache_misses_total', lambda: predict_proba.cache_info().misses, help='Slider predictions the in-process LRU cache did not have.')
+metrics.counter('prediction_store_hits_total', lambda: predict_proba.stats['store_hits'], help='Slider predictions served by the shared on-disk store.')
 
 
 
@@ -28,13 +37,39 @@ sliders = [html.Div(dcc.Slider(
                                 min=min(_data[col].dropna().astype(int)), 
                                 max=max(_data[col].dropna().astype(int))
                            ), style={'maxWidth': '450px'}, className='col-md-9') 
-           for i, col in enumerate(_data.columns.drop(['V2026']))]
+           for i, col in enumerate(mf.feature_cols)]
+
+defaults = [slider.children.value for slider in sliders]
+
+# Class probabilities along each slider's whole range with every other slider
+# at its default, scored in one batch. Moving a single slider away from the
+# defaults is then a lookup in curves instead of a model call.
+grid = [(i, v) for i, slider in enumerate(sliders) for v in range(slider.children.min, slider.children.max + 1)]
+grid_rows = np.tile(np.array(defaults, dtype=float), (len(grid), 1))
+grid_rows[np.arange(len(grid)), [i for i, _ in grid]] = [v for _, v in grid]
+curves = [{} for _ in sliders]
+for (i, v), proba in zip(grid, forest_proba(grid_rows)):
+    curves[i][v] = tuple(proba.tolist())
+
+def sparkline(i):
+    values = sorted(curves[i])
+    expected = [np.dot(curves[i][v], forest_proba.classes_) for v in values]
+    fig = go.Figure(go.Scatter(x=values, y=expected, mode='lines', line={'color': mf.colors['link-col']}, 
+                               hovertemplate='%{x}: expected bracket %{y:.1f}<extra></extra>'))
+    fig.update_layout(height=50, margin={'l': 0, 'r': 0, 't': 0, 'b': 0}, showlegend=False, 
+                      xaxis={'visible': False}, yaxis={'visible': False}, 
+                      plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
+    return html.Div(dcc.Graph(figure=fig, config={'displayModeBar': False}), 
+                    style={'maxWidth': '450px'}, className='col-md-9')
+
+sparklines = [sparkline(i) for i in range(len(sliders))]
 
 zipped = zip([html.P(html.A(f"{mf.dataDictionary[col]['Desc']}", 
                             href=f"https://www.icpsr.umich.edu/icpsrweb/NACJD/studies/36834/_datasets/0003/variables/{col}?archive=nacjd", 
                             target='_blank')) 
-             for col in _data.columns], 
-             sliders
+             for col in mf.feature_cols], 
+             sliders, 
+             sparklines
              )
 
 flatten = [item for sublist in zipped for item in sublist]
@@ -77,7 +112,7 @@ column1 = dbc.Col(
 							dcc.Dropdown(
 								id='plot_against_income',
 								options=[
-									{'label': mf.dataDictionary[c]['Desc'], 'value': c} for c in _data.columns.drop(['V2026'])
+									{'label': mf.dataDictionary[c]['Desc'], 'value': c} for c in mf.feature_cols
                                 ],
 								className='mb-5',
 								value='YEAR'
@@ -130,73 +165,61 @@ column2 = dbc.Col(
 
 layout = dbc.Row([column1, column2])
 
-def heatmap_z(hm):
-    counts = {}
-    x = pd.Series(hm.data[0].x)
-    y = pd.Series(hm.data[0].y)
-
-    for zipped in zip(x,y):
-        if zipped not in counts.keys():
-            counts[zipped] = 1
-        else:
-            counts[zipped] += 1
-    return counts
-
-def heatmap_z_min_max(hm):
-    counts = heatmap_z(hm)
-
-    #print(f"Min: {min(counts.values())}\nMax: {max(counts.values())}")
-    return list((min(counts.values()), max(counts.values())))
-
-
-@app.callback(
-	Output('analysis_content', 'children'),
-	[Input('plot_against_income', 'value')]
-)
+# analyze and prediction are the callbacks behind this layout; they are
+# registered in pages/index_callbacks.py, which imports this module on first use
 def analyze(plot_against_income):
-    fig = px.density_heatmap(_data, x=plot_against_income, y="V2026")
-    fig = px.density_heatmap(_data, x=plot_against_income, y="V2026", title='<b>Expected Income</b>\r\n(Hover for details)', height=400, width=400, nbinsx=pd.Series(_data[plot_against_income]).nunique(), nbinsy=pd.Series(_data['V2026']).nunique(), range_color=heatmap_z_min_max(fig))
-    fig.layout['xaxis']['title']['text'] = mf.dataDictionary[plot_against_income]['Desc'].capitalize()
-    fig.layout['yaxis']['title']['text'] = 'Income Bracket'
-    fig.layout['coloraxis']['colorbar']['title']['text'] = 'Count'
     graph = dcc.Graph(
-        figure=fig
+        figure=heatmap_figure(plot_against_income)
     )
     return graph
 
-empty = html.Div(id='hidden-div', style={'display':'none'})
+aggregate = mf.survey_aggregates(_data)
+
+# count of every (income bracket, feature value) pair, one per dropdown option,
+# weighted up to persons when the weight is available
+crosstabs = {col: aggregate(col, weight=weight) for col in mf.feature_cols}
+z_label = 'Persons' if weight else 'Count'
+
+@lru_cache(maxsize=None)
+def heatmap_figure(plot_against_income):
+    # only the binned counts go to the browser, so the payload doesn't grow with the data
+    counts = crosstabs[plot_against_income]
+    z_range = [counts.values.min(), counts.values.max()] if counts.size else [0, 0]
+    fig = go.Figure(go.Heatmap(z=counts.values, x=counts.columns, y=counts.index, 
+                               zmin=z_range[0], zmax=z_range[1], colorscale='Plasma', 
+                               hovertemplate=f"{plot_against_income}=%{{x}}<br>V2026=%{{y}}<br>{z_label.lower()}=%{{z:,.0f}}<extra></extra>"))
+    fig.update_layout(title='<b>Expected Income</b>\r\n(Hover for details)', height=400, width=400)
+    fig.layout['xaxis']['title']['text'] = mf.dataDictionary[plot_against_income]['Desc'].capitalize()
+    fig.layout['yaxis']['title']['text'] = 'Income Bracket'
+    fig.data[0]['colorbar']['title']['text'] = z_label
+    # cache the finished, JSON-ready figure rather than the Figure object
+    return json.loads(fig.to_json())
+
+def warm_up():
+    """
+    Build every dropdown's heatmap ahead of time. Run in the gunicorn master
+    (see gunicorn.conf.py) so forked workers inherit the finished figures.
+    """
+    for col in crosstabs:
+        heatmap_figure(col)
 
-@app.callback(
-	Output('predict_content', 'children'),
-	[
-        Input(f"input-{i}", 'value') for i in range(0, len(_data.columns.drop(['V2026'])))
-    ]
-)
-def prediction_val(input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14):
-    forest = model.named_steps['randomforestclassifier']
-    num = forest.predict([[input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14]])
-    return num
-
-@app.callback(
-	Output('predict_confidence', 'children'),
-	[
-        Input(f"input-{i}", 'value') for i in range(0, len(_data.columns.drop(['V2026'])))
-    ]
-)
-def prediction_proba(input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14):
-    forest = model.named_steps['randomforestclassifier']
-    confidence = forest.predict_proba([[input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14]])
-    return f"{max(confidence[0]) * 100:.2f}%"
+empty = html.Div(id='hidden-div', style={'display':'none'})
 
+def prediction(input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14):
+    inputs = [input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14]
+    changed = [i for i, value in enumerate(inputs) if value != defaults[i]]
+    confidence = None
+    if len(changed) <= 1:
+        i = changed[0] if changed else 0
+        confidence = curves[i].get(inputs[i])
+        if confidence is not None:
+            metrics.inc('prediction_curve_hits_total', help='Slider predictions served from the precomputed slider curves.')
+    if confidence is None:
+        confidence = predict_proba(inputs)
+    # same as forest.predict, without walking the trees a second time
+    num = forest_proba.classes_.take([np.argmax(confidence)])
+    return num, f"{max(confidence) * 100:.2f}%"
 
-@app.callback(
-	Output('slider-vals', 'children'),
-	[
-        Input(f"input-{i}", 'value') for i in range(0, len(_data.columns.drop(['V2026'])))
-    ]
-)
-def prediction_proba(input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14):
-    return [input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14]
 
 #
 # MUST FIXES:
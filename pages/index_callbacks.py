@@ -0,0 +1,44 @@
+# Imports from 3rd party libraries
+from dash.dependencies import Input, Output
+
+# Imports from this application
+from app import app
+import MyFuncs as mf
+import metrics
+
+# The index page's callbacks, registered without importing the page: Dash
+# needs every callback when the browser fetches /_dash-dependencies, on any
+# page, but pages.index loads the model and the dataset. It is imported the
+# first time one of its callbacks actually runs (or ahead of time by the
+# gunicorn master, see gunicorn.conf.py).
+
+@app.callback(
+	Output('analysis_content', 'children'),
+	[Input('plot_against_income', 'value')]
+)
+@metrics.timed('analyze')
+def analyze(plot_against_income):
+    from pages import index
+
+    return index.analyze(plot_against_income)
+
+@app.callback(
+	[Output('predict_content', 'children'), Output('predict_confidence', 'children')],
+	[
+        Input(f"input-{i}", 'value') for i in range(0, len(mf.feature_cols))
+    ]
+)
+@metrics.timed('prediction')
+def prediction(*inputs):
+    from pages import index
+
+    return index.prediction(*inputs)
+
+@app.callback(
+	Output('slider-vals', 'children'),
+	[
+        Input(f"input-{i}", 'value') for i in range(0, len(mf.feature_cols))
+    ]
+)
+def prediction_proba(input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14):
+    return [input_0, input_1, input_2, input_3, input_4, input_5, input_6, input_7, input_8, input_9, input_10, input_11, input_12, input_13, input_14]
@@ -1,18 +1,18 @@
 # Imports from 3rd party libraries
+import importlib
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objs as go
+from flask import Response, request
 
 # Imports from this application
 from app import app, server
-from pages import index, predictions, insights, process
+import api # registers the batch scoring endpoint on server
+import pages.index_callbacks # registers the index page's callbacks without loading the page
 import MyFuncs as mf
+import metrics
 
 # Navbar docs: https://dash-bootstrap-components.opensource.faculty.ai/l/components/navbar
 navbar = dbc.Navbar(
@@ -70,20 +70,53 @@ app.layout = html.Div([
 
 
 # URL Routing for Multi-Page Apps: https://dash.plot.ly/urls
+# Page modules are imported on first visit, so pages.index (and with it the
+# model and the dataset) only loads when a route needs it. The first response
+# for each route is kept as bytes and replayed for every later visit, so a
+# layout is serialized once rather than on every page load.
+routes = {
+    '/': 'pages.index',
+    '/predictions': 'pages.predictions',
+    '/insights': 'pages.insights',
+    '/process': 'pages.process'
+}
+
+page_responses = {}
+
+def routed_path():
+    """ The route a /_dash-update-component request asks display_page for, if any. """
+    if not request.path.endswith('/_dash-update-component'):
+        return None
+    body = request.get_json(silent=True) or {}
+    if body.get('output') != 'page-content.children' or not body.get('inputs'):
+        return None
+    pathname = body['inputs'][0].get('value') or '/'
+    return pathname if pathname in routes else None
+
+@server.before_request
+def cached_page():
+    pathname = routed_path()
+    if pathname in page_responses:
+        metrics.inc('layout_cache_hits_total', help='Page loads answered with an already serialized layout.')
+        return Response(page_responses[pathname], mimetype='application/json')
+
+@server.after_request
+def cache_page(response):
+    pathname = routed_path()
+    if pathname is not None and pathname not in page_responses and response.status_code == 200:
+        page_responses[pathname] = response.get_data()
+    return response
+
 @app.callback(Output('page-content', 'children'),
               [Input('url', 'pathname')])
+@metrics.timed('display_page')
 def display_page(pathname):
-#    if pathname == '/':
-#        return index.layout
-#    elif pathname == '/predictions':
-#        return predictions.layout
-#    elif pathname == '/insights':
-#        return insights.layout
-#    elif pathname == '/process':
-#        return process.layout
-#    else:
-#        return dcc.Markdown('## Page not found')
-    return index.layout
+    if pathname is None:
+        pathname = '/'
+    if pathname in routes:
+        return importlib.import_module(routes[pathname]).layout
+    else:
+        return dcc.Markdown('## Page not found')
 
 # Run app server: https://dash.plot.ly/getting-started
 if __name__ == '__main__':
@@ -0,0 +1,17 @@
+# Batch scoring from the command line:
+#   python score.py respondents.csv predictions.csv --workers 8 --chunksize 100000
+import argparse
+
+import MyFuncs as mf
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Predict the income bracket of every respondent in a CSV.')
+    parser.add_argument('file', help=f"CSV with a header including {', '.join(mf.feature_cols)}")
+    parser.add_argument('out_file', help='where to write the prediction and confidence for each row')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows scored per task')
+    parser.add_argument('--model', default='assets/model.sav', help='pickled pipeline to score with')
+    args = parser.parse_args()
+
+    rows = mf.score_file(args.file, args.out_file, workers=args.workers, chunksize=args.chunksize, model_file=args.model, output=True)
+    print(f"Wrote {rows} predictions to {args.out_file}")